@@ -0,0 +1,74 @@
+import os
+import sys
+import argparse
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from src.utils.prompts import build_messages, count_tokens
+
+# Compares input tokens of the previous inline prompt with the current template
+parser = argparse.ArgumentParser(description="Compare prompt tokens of the old and new generation prompts")
+parser.add_argument("--file", help="text file to take context chunks from (default: built-in sample)")
+parser.add_argument("--chunk-size", type=int, default=1000)
+parser.add_argument("--top-k", type=int, default=5)
+args = parser.parse_args()
+
+SAMPLE = """India, officially the Republic of India, is a country in South Asia.
+It is the seventh-largest country by area and the most populous country in the world.
+
+    Bounded by the Indian Ocean on the south, the Arabian Sea on the southwest,
+    and the Bay of Bengal on the southeast, it shares land borders with Pakistan to the west.
+
+Major rivers:
+  - Ganga
+  - Yamuna
+  - Brahmaputra
+
+| State       | Capital     |
+|-------------|-------------|
+| Maharashtra | Mumbai      |
+| Karnataka   | Bengaluru   |
+
+The capital is New Delhi and the largest city by population is Mumbai.   """
+
+
+def legacy_messages(query, documents):
+    """The prompt RAGService.query built before the template module existed."""
+    context = "\n\n".join([f"Document: {doc.title}\nContent: {doc.content}" for doc in documents])
+    prompt = f"""
+            You are a helpful assistant that provides accurate information about India based on the given context.
+            If the information is not in the context, politely say that you don't have that information.
+            Do not make up answers. Stick to the provided context.
+
+            Context:
+            {context}
+
+            Question: {query}
+
+            Answer:
+            """
+    return [
+        {"role": "system", "content": "You are a helpful assistant that provides accurate information about India."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+if args.file:
+    with open(args.file, "r", encoding="utf-8") as file:
+        text = file.read()
+else:
+    text = SAMPLE * (args.chunk_size * args.top_k // len(SAMPLE) + 1)
+
+chunks = [text[i:i + args.chunk_size] for i in range(0, len(text), args.chunk_size)][:args.top_k]
+documents = [SimpleNamespace(title="India Overview", content=chunk) for chunk in chunks]
+query = "What is the capital of India?"
+
+old_tokens = count_tokens(legacy_messages(query, documents))
+new_tokens = count_tokens(build_messages(query, documents))
+empty_old = count_tokens(legacy_messages(query, []))
+empty_new = count_tokens(build_messages(query, []))
+
+print(f"{len(documents)} chunks of up to {args.chunk_size} characters")
+print(f"Template overhead (no context): {empty_old} -> {empty_new} tokens")
+print(f"Full prompt: {old_tokens} -> {new_tokens} tokens ({(old_tokens - new_tokens) / old_tokens:.1%} fewer)")
@@ -0,0 +1,174 @@
+import os
+import sys
+import time
+import tempfile
+import argparse
+import numpy as np
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from src.models.document import Document
+from src.dao.vector_index import ExactSearchIndex
+from src.dao.compressed_index import CompressedIndex
+
+# Benchmarks the exact (and compressed) search index on synthetic data, or checks them against match_documents
+parser = argparse.ArgumentParser(description="Benchmark the local vector search indexes")
+parser.add_argument("--chunks", type=int, default=100_000)
+parser.add_argument("--dimension", type=int, default=768)
+parser.add_argument("--queries", type=int, default=100)
+parser.add_argument("--top-k", type=int, default=5)
+parser.add_argument("--compare-dao", action="store_true", help="compare against DocumentDAO.search_documents on Supabase")
+parser.add_argument("--compression", action="store_true", help="also report memory and recall of the compressed index")
+parser.add_argument("--small-corpus", action="store_true", help="check compressed search on indexes smaller than the reduced dimension")
+args = parser.parse_args()
+
+
+def timed_search(index, queries, top_k):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append([doc.id for doc in index.search(query, top_k)])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, latencies
+
+
+def recall(results, reference):
+    hits = sum(len(set(r) & set(ref)) for r, ref in zip(results, reference))
+    return hits / max(1, sum(len(ref) for ref in reference))
+
+
+def report_compression(exact_index, queries, top_k, reference=None):
+    """Memory and recall@k of the compressed index against `reference` ids (default: exact search)."""
+    settings = [
+        ("pca", 256, "pq"),
+        ("matryoshka", 256, "pq"),
+        ("pca", 256, "int8"),
+        ("none", exact_index.dimension, "int8"),
+    ]
+    for reduction, dimension, quantizer in settings:
+        start = time.perf_counter()
+        compressed = CompressedIndex(exact_index, reduction=reduction, dimension=dimension, quantizer=quantizer).fit()
+        fit_time = time.perf_counter() - start
+
+        results, latencies = timed_search(compressed, queries, top_k)
+        report = compressed.memory_report()
+        recalls = compressed.recall_report(queries, top_k, reference)
+
+        print(f"\n{reduction}-{dimension} + {quantizer}: fit {fit_time:.1f} s")
+        print(f"  {report['code_bytes_per_vector']} bytes/vector vs {report['full_bytes_per_vector']} float32"
+              f" ({report['json_bytes_per_vector']} as JSON text), {report['reduction_factor']:.0f}x smaller")
+        print(f"  total {report['compressed_total_bytes'] / 1e6:.1f} MB vs {report['full_total_bytes'] / 1e6:.1f} MB")
+        print(f"  p50 {np.percentile(latencies, 50):.3f} ms, p99 {np.percentile(latencies, 99):.3f} ms")
+        print(f"  recall@{top_k} re-scored {recalls[f'recall@{top_k}']:.4f}, codes only {recalls[f'recall@{top_k}_codes_only']:.4f}")
+
+
+def check_small_corpus(dimension, top_k):
+    """Compressed search on corpora with fewer rows than the reduced dimension or MIN_FIT_ROWS."""
+    rng = np.random.default_rng(0)
+    created_at = datetime.now(timezone.utc)
+    for rows in [10, 100, 300, CompressedIndex.MIN_FIT_ROWS]:
+        with tempfile.TemporaryDirectory() as directory:
+            index = ExactSearchIndex(directory)
+            embeddings = rng.standard_normal((rows, dimension)).astype(np.float32)
+            index.build([
+                Document(id=i, title="small", content="", chunk_id=f"small_{i}", embedding=embeddings[i].tolist(), created_at=created_at)
+                for i in range(rows)
+            ])
+            queries = list(embeddings[:20])
+            for quantizer in CompressedIndex.QUANTIZERS:
+                compressed = CompressedIndex(index, quantizer=quantizer)
+                in_use = compressed.sync()
+                fallback = compressed.recall_report(queries, top_k)[f"recall@{top_k}"]
+                # Fitting explicitly works at any size, with the dimension capped by the row count
+                compressed.fit()
+                recalls = compressed.recall_report(queries, top_k)
+                shape = f"{compressed.state['dimension']}-d"
+                if quantizer == "pq":
+                    shape += f" / {compressed.state['subvectors']} sub-vectors"
+                print(f"{rows} rows, pca + {quantizer}: synced {'compressed' if in_use else 'exact'} recall {fallback:.4f}, "
+                      f"fitted to {shape}, recall@{top_k} {recalls[f'recall@{top_k}']:.4f}")
+
+
+if args.small_corpus:
+    check_small_corpus(args.dimension, args.top_k)
+    sys.exit(0)
+
+if args.compare_dao:
+    # Uses stored chunk embeddings as queries, so Supabase credentials must be set
+    os.environ["VECTOR_SEARCH_BACKEND"] = "supabase"
+    from src.dao.document_dao import DocumentDAO
+
+    # Parent spans have no embedding and are not searched
+    documents = [doc for doc in DocumentDAO.get_all_documents() if doc.embedding]
+    print(f"Loaded {len(documents)} embedded chunks from Supabase")
+
+    with tempfile.TemporaryDirectory() as directory:
+        index = ExactSearchIndex(directory)
+        index.build(documents)
+
+        rng = np.random.default_rng(0)
+        sample = rng.choice(len(documents), size=min(args.queries, len(documents)), replace=False)
+        queries = [documents[i].embedding for i in sample]
+
+        exact, latencies = timed_search(index, queries, args.top_k)
+        reference = [[doc.id for doc in DocumentDAO.search_documents(q, args.top_k)] for q in queries]
+
+        print(f"Exact index p50 latency: {np.percentile(latencies, 50):.3f} ms")
+        print(f"Agreement with match_documents (recall@{args.top_k}): {recall(exact, reference):.4f}")
+
+        if args.compression:
+            report_compression(index, queries, args.top_k, reference)
+    sys.exit(0)
+
+print(f"Generating {args.chunks} synthetic {args.dimension}-d embeddings...")
+rng = np.random.default_rng(0)
+# Real embeddings concentrate in a low-dimensional subspace, so mix a few latent factors plus noise
+latent = rng.standard_normal((args.chunks, 64)).astype(np.float32)
+embeddings = latent @ rng.standard_normal((64, args.dimension)).astype(np.float32)
+embeddings += 2.0 * rng.standard_normal(embeddings.shape).astype(np.float32)
+queries = embeddings[rng.choice(args.chunks, size=args.queries, replace=False)]
+queries = queries + 0.1 * rng.standard_normal(queries.shape).astype(np.float32)
+
+created_at = datetime.now(timezone.utc)
+
+
+def build_synthetic(index, batch_size=10_000):
+    # Appending in batches keeps the Document objects for one batch in memory at a time
+    index.clear()
+    for start in range(0, len(embeddings), batch_size):
+        index.append([
+            Document(id=i, title="synthetic", content="", chunk_id=f"synthetic_{i}", embedding=embeddings[i].tolist(), created_at=created_at)
+            for i in range(start, min(start + batch_size, len(embeddings)))
+        ])
+
+
+reference = None
+for dtype in ExactSearchIndex.DTYPES:
+    with tempfile.TemporaryDirectory() as directory:
+        index = ExactSearchIndex(directory, dtype=dtype)
+        start = time.perf_counter()
+        build_synthetic(index)
+        build_time = time.perf_counter() - start
+
+        # Re-open from disk so search runs on the memory map
+        index = ExactSearchIndex(directory, dtype=dtype)
+        results, latencies = timed_search(index, queries, args.top_k)
+        if reference is None:
+            reference = results
+
+        size_mb = os.path.getsize(index.matrix_path) / 1e6
+        print(f"\n{dtype}: build {build_time:.1f} s, matrix {size_mb:.1f} MB")
+        print(f"  p50 {np.percentile(latencies, 50):.3f} ms, p99 {np.percentile(latencies, 99):.3f} ms")
+        print(f"  recall@{args.top_k} vs float32: {recall(results, reference):.4f}")
+
+        start = time.perf_counter()
+        index.search_batch(queries, args.top_k)
+        print(f"  batch of {len(queries)}: {(time.perf_counter() - start) * 1000:.3f} ms")
+
+if args.compression:
+    with tempfile.TemporaryDirectory() as directory:
+        index = ExactSearchIndex(directory)
+        build_synthetic(index)
+        report_compression(index, list(queries), args.top_k)
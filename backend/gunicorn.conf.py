@@ -0,0 +1,30 @@
+# Production server configuration: gunicorn -c gunicorn.conf.py run:app
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+workers = int(os.environ.get("WORKERS", multiprocessing.cpu_count()))
+os.environ["WORKERS"] = str(workers)  # read by the rate limiters to split backend quotas between workers
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Import the app once in the master so workers fork with modules (and the
+# memory-mapped index) already loaded instead of each importing its own copy
+preload_app = True
+
+# Let in-flight requests finish on SIGTERM/SIGHUP before workers are killed
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", 30))
+timeout = int(os.environ.get("WORKER_TIMEOUT", 120))
+keepalive = 5
+
+# Recycle workers periodically to bound memory growth, staggered so they do not restart together
+max_requests = int(os.environ.get("MAX_REQUESTS", 10000))
+max_requests_jitter = max_requests // 10
+
+def on_starting(server):
+    # Build or map the local index (and fit the compressed codes) once, before any
+    # worker exists, so workers share the mapping instead of racing to build it.
+    # Workers create their own Supabase client (db.get_client), so the connections
+    # opened here are not shared with them
+    from src.dao.document_dao import DocumentDAO
+    if DocumentDAO.use_exact_index():
+        DocumentDAO.sync_local_index()
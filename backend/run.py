@@ -1,4 +1,3 @@
-# run.py
 import os#entry point
 import sys
 import uvicorn  # Add this import
@@ -8,14 +7,48 @@ sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
 from src.main import app
 
+def serve_production(port: int):
+    """Serve with multiple preloaded workers using gunicorn.conf.py, or plain uvicorn workers without gunicorn"""
+    try:
+        from gunicorn.app.wsgiapp import WSGIApplication
+    except ImportError:
+        # No preloading here, each worker imports the app itself (e.g. on Windows)
+        print("gunicorn is not installed, starting uvicorn workers")
+        from src.dao.document_dao import DocumentDAO
+        from src.dao.vector_index import fcntl
+        if DocumentDAO.use_exact_index() and fcntl is None:
+            # No cross-process file locks (Windows): several workers writing the index would corrupt it
+            if int(os.environ.get("WORKERS", 1)) > 1:
+                print("File locking is unavailable, serving the local index with a single worker")
+            os.environ["WORKERS"] = "1"
+        os.environ.setdefault("WORKERS", str(os.cpu_count() or 1))
+        # Build the local index and fit its codes before the workers start serving
+        if DocumentDAO.use_exact_index():
+            DocumentDAO.sync_local_index()
+        uvicorn.run(
+            "run:app",
+            host="0.0.0.0",
+            port=port,
+            workers=int(os.environ["WORKERS"]),
+            timeout_graceful_shutdown=int(os.environ.get("GRACEFUL_TIMEOUT", 30))
+        )
+        return
+
+    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py")
+    sys.argv = ["gunicorn", "-c", config_path, "run:app"]
+    WSGIApplication("%(prog)s [OPTIONS] [APP_MODULE]").run()
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
-    debug = os.environ.get("DEBUG", "true").lower() == "true"
-    
-    uvicorn.run(#Auto-reload for development, configurable port and debug mode
-        "run:app",
-        host="0.0.0.0",
-        port=port,
-        reload=debug,
-        reload_dirs=["src"]
-    )
\ No newline at end of file
+    debug = os.environ.get("DEBUG", "false").lower() == "true"
+
+    if debug:
+        uvicorn.run(#Auto-reload for development, configurable port and debug mode
+            "run:app",
+            host="0.0.0.0",
+            port=port,
+            reload=True,
+            reload_dirs=["src"]
+        )
+    else:
+        serve_production(port)
@@ -8,6 +8,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from src.controllers.rag_controller import router as rag_controller
 from src.middleware.error_handlers import setup_error_handlers
+from src.middleware.admission import setup_admission_control
 
 def create_app() -> FastAPI:
     app = FastAPI(
@@ -25,6 +26,9 @@ def create_app() -> FastAPI:
         allow_headers=["*"],
     )
     
+    # Queue or shed query requests when backends are saturated
+    setup_admission_control(app)
+    
     # Include routers directly
     app.include_router(rag_controller, prefix="/api/rag", tags=["rag"])
     
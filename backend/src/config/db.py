@@ -24,5 +24,18 @@ except Exception as e:
     print(f"Error creating Supabase client: {str(e)}")
     raise
 
+_client_pid = os.getpid()
+
+def get_client() -> Client:
+    """
+    The Supabase client of the current process. A forked worker must not share the
+    parent's pooled HTTP connections, so it creates its own client on first use.
+    """
+    global supabase, _client_pid
+    if _client_pid != os.getpid():
+        supabase = create_client(supabase_url, supabase_key)
+        _client_pid = os.getpid()
+    return supabase
+
 # Export the supabase client
-__all__ = ['supabase']
\ No newline at end of file
+__all__ = ['supabase', 'get_client']
\ No newline at end of file
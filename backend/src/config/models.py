@@ -3,6 +3,7 @@ from groq import Groq
 from dotenv import load_dotenv
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 import ollama
+from src.utils.embedding_cache import EmbeddingCache
 
 load_dotenv()
 
@@ -10,10 +11,30 @@ load_dotenv()
 EMBEDDING_MODEL = "nomic-embed-text"
 EMBEDDING_DIMENSION = 768  # nomic-embed-text produces 768-dimensional embeddings
 
-# LangChain text splitter
+# Vector search backend: "supabase" (match_documents), "exact" (local memory-mapped index)
+# or "compressed" (quantized codes over the local index, re-scored at full precision)
+VECTOR_SEARCH_BACKEND = os.environ.get("VECTOR_SEARCH_BACKEND", "supabase").lower()
+VECTOR_INDEX_DIR = os.environ.get("VECTOR_INDEX_DIR", "data/index")
+VECTOR_INDEX_DTYPE = os.environ.get("VECTOR_INDEX_DTYPE", "float32")  # float32, float16 or int8
+
+# Compression settings for the "compressed" backend
+VECTOR_COMPRESSION_REDUCTION = os.environ.get("VECTOR_COMPRESSION_REDUCTION", "pca")  # pca, matryoshka or none
+VECTOR_COMPRESSION_DIMENSION = int(os.environ.get("VECTOR_COMPRESSION_DIMENSION", 256))
+VECTOR_COMPRESSION_QUANTIZER = os.environ.get("VECTOR_COMPRESSION_QUANTIZER", "pq")  # pq or int8
+
+# On-disk embedding cache shared by all workers, set EMBEDDING_CACHE_PATH="" to disable
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "data/cache/embeddings.sqlite")
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_MODEL) if EMBEDDING_CACHE_PATH else None
+
+# Two-level chunking: small sentence-window chunks are embedded for matching,
+# the parent spans they belong to are what gets sent to the LLM
+PARENT_CHUNK_SIZE = 1000
+CHILD_CHUNK_SIZE = 250  # sentences are packed into windows of at most this many characters
+
+# LangChain text splitter for parent spans (no overlap, children carry the matching)
 text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1000,
-    chunk_overlap=200,
+    chunk_size=PARENT_CHUNK_SIZE,
+    chunk_overlap=0,
     length_function=len
 )
 
@@ -21,7 +42,7 @@ text_splitter = RecursiveCharacterTextSplitter(
 groq_api_key = os.environ.get("GROQ_API_KEY")
 if not groq_api_key:
     raise ValueError("GROQ_API_KEY must be set in environment variables")
-groq_client = Groq(api_key=groq_api_key)
+groq_client = Groq(api_key=groq_api_key, max_retries=0)  # retries are paced by the rate limiters
 
 # Use one of the available models that doesn't require terms acceptance
 generation_model = "llama-3.1-8b-instant"  # Primary model
@@ -1,8 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from typing import List
 from src.services.rag_service import RAGService
-from src.models.document import QueryRequest, QueryResponse
+from src.models.document import QueryRequest, QueryResponse, BatchQueryRequest
+from src.middleware.admission import generation_slots
 import traceback
+import json
 import os
 #Api endpoints,handles http req, file upload handling form data processing,error response
 router = APIRouter()
@@ -76,12 +80,31 @@ async def query_documents(query_request: QueryRequest):
     Process a user query by retrieving relevant documents and generating a response.
     """
     try:
-        return RAGService.query(query_request)
+        # Run in the threadpool so waiting on backends does not block the event loop
+        async with generation_slots():
+            return await run_in_threadpool(RAGService.query, query_request)
     except Exception as e:
         print(f"Error processing query: {str(e)}")
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
 
+@router.post("/query/batch")
+async def query_documents_batch(batch_request: BatchQueryRequest):
+    """
+    Process several queries in one request. Results are streamed back as
+    newline-delimited JSON, one line per query, in the order they finish.
+    """
+    async def stream_results():
+        try:
+            async for result in RAGService.query_batch(batch_request):
+                yield result.model_dump_json() + "\n"
+        except Exception as e:
+            print(f"Error processing batch query: {str(e)}")
+            print(traceback.format_exc())
+            yield json.dumps({"error": f"Error processing batch query: {str(e)}"}) + "\n"
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
 @router.delete("/clear-database", response_model=dict)
 async def clear_database():
     """
@@ -0,0 +1,483 @@
+import os
+import json
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import List, Optional
+from src.models.document import Document
+from src.dao.vector_index import ExactSearchIndex
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run a single worker
+    fcntl = None
+#Compressed vector search: dimensionality reduction + quantized codes, re-scored at full precision
+class CompressedIndex:
+    """
+    Compressed copy of an ExactSearchIndex for large corpora. Embeddings are
+    reduced (PCA, or Matryoshka truncation for models trained for it such as
+    nomic-embed-text) and quantized (product quantization or scalar int8).
+    Search scores the codes against the uncompressed query (asymmetric
+    distance), then re-scores the best candidates with the full vectors from
+    the exact index, so only those rows of the full matrix are ever read.
+
+    Fitting and encoding only happen in the write path (`sync` after rows are
+    appended, or `fit`). The model and codes are stored next to the exact index
+    files and published through a manifest, so every worker maps the same codes.
+    Until a fit for the current generation of the exact index exists (a new,
+    rebuilt or small index), searches fall back to exact search.
+    """
+    REDUCTIONS = ("pca", "matryoshka", "none")
+    QUANTIZERS = ("pq", "int8")
+    CODE_DTYPES = {
+        "pq": np.uint8,
+        "int8": np.int8,
+    }
+    MODEL_ARRAYS = ("mean", "components", "codebooks", "scale", "offset")
+
+    PQ_CENTROIDS = 256  # one byte per sub-vector code
+    KMEANS_ITERATIONS = 15
+    TRAIN_SAMPLE = 50000  # rows used to fit PCA and the codebooks
+    BLOCK_ROWS = 65536  # rows scored at a time, bounds temporary memory
+    MIN_FIT_ROWS = 4 * PQ_CENTROIDS  # below this exact search is as fast and k-means has too few rows
+
+    MANIFEST_FILE = "compressed.json"
+    LOCK_FILE = "compressed.lock"
+
+    def __init__(
+        self,
+        exact_index: ExactSearchIndex,
+        reduction: str = "pca",
+        dimension: int = 256,
+        quantizer: str = "pq",
+        subvectors: int = 32,
+        rerank_factor: int = 10,
+        seed: int = 0
+    ):
+        if reduction not in self.REDUCTIONS:
+            raise ValueError(f"Unsupported reduction '{reduction}', expected one of {list(self.REDUCTIONS)}")
+        if quantizer not in self.QUANTIZERS:
+            raise ValueError(f"Unsupported quantizer '{quantizer}', expected one of {list(self.QUANTIZERS)}")
+        self.exact_index = exact_index
+        self.directory = exact_index.directory
+        self.reduction = reduction
+        self.dimension = dimension
+        self.quantizer = quantizer
+        self.subvectors = subvectors
+        self.rerank_factor = rerank_factor
+        self.seed = seed
+
+        self.state = None  # fitted model, codes and manifest fields, replaced as a whole
+        self.fit_id = 0
+        self.manifest_stamp = None
+        self.lock = threading.RLock()  # guards loading and swapping `state`
+        self.writer = threading.Lock()  # one fit or encode at a time in this process
+        self.load()
+
+    @property
+    def settings(self) -> dict:
+        return {
+            "reduction": self.reduction,
+            "dimension": self.dimension,
+            "quantizer": self.quantizer,
+            "subvectors": self.subvectors,
+            "seed": self.seed,
+        }
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, self.MANIFEST_FILE)
+
+    def model_path(self, fit_id: int) -> str:
+        return os.path.join(self.directory, f"compressed_model.{fit_id}.npz")
+
+    def codes_path(self, fit_id: int) -> str:
+        return os.path.join(self.directory, f"codes.{fit_id}.bin")
+
+    @property
+    def count(self) -> int:
+        return self.state["count"] if self.state else 0
+
+    @property
+    def codes(self) -> Optional[np.ndarray]:
+        return self.state["codes"] if self.state else None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+    def _code_width(self, state: dict) -> int:
+        return state["subvectors"] if self.quantizer == "pq" else state["dimension"]
+
+    def load(self) -> None:
+        """Load the published model and map its codes, if a fit with these settings exists."""
+        with self.lock:
+            while True:
+                stamp = self._stamp()
+                if stamp is None:
+                    self.state = None
+                    self.manifest_stamp = None
+                    return
+
+                with open(self.manifest_path, "r", encoding="utf-8") as file:
+                    manifest = json.load(file)
+                self.manifest_stamp = stamp
+                self.fit_id = manifest["fit"]
+                if manifest["settings"] != self.settings:
+                    # Fitted with other settings, the next sync fits again
+                    self.state = None
+                    return
+
+                try:
+                    with np.load(self.model_path(manifest["fit"])) as model:
+                        arrays = {name: model[name] for name in model.files}
+                    codes = None
+                    if manifest["count"]:
+                        codes = np.memmap(
+                            self.codes_path(manifest["fit"]),
+                            dtype=self.CODE_DTYPES[self.quantizer],
+                            mode="r",
+                            shape=(manifest["count"], self._code_width(manifest))
+                        )
+                except FileNotFoundError:
+                    # Another process published a new fit in the meantime, read the new manifest
+                    continue
+                self.state = {**manifest, **arrays, "codes": codes}
+                return
+
+    def refresh(self) -> None:
+        """Pick up fits and codes published by other processes since the last load."""
+        if self._stamp() != self.manifest_stamp:
+            self.load()
+
+    @staticmethod
+    def _ready(state: Optional[dict], generation: int, rows: int) -> bool:
+        # Codes describe a prefix of the rows of one generation of the exact index
+        return state is not None and state["generation"] == generation and state["count"] <= rows
+
+    @staticmethod
+    def _full_rows(matrix: np.ndarray, rows) -> np.ndarray:
+        block = matrix[rows].astype(np.float32)
+        if matrix.dtype == np.int8:
+            block /= ExactSearchIndex.INT8_SCALE
+        return block
+
+    def _reduce(self, state: dict, vectors: np.ndarray) -> np.ndarray:
+        if self.reduction == "pca":
+            return (vectors - state["mean"]) @ state["components"].T
+        if self.reduction == "matryoshka":
+            truncated = vectors[:, :state["dimension"]]
+            norms = np.linalg.norm(truncated, axis=1, keepdims=True)
+            return truncated / np.where(norms == 0, 1, norms)
+        return vectors
+
+    def _reduce_queries(self, state: dict, queries: np.ndarray) -> np.ndarray:
+        # Rows are stored as x ~ mean + components.T @ r, so q.x ~ q.mean + r.(components @ q);
+        # q.mean is the same for every row and can be dropped from the ranking
+        if self.reduction == "pca":
+            return queries @ state["components"].T
+        return self._reduce(state, queries)
+
+    def _kmeans(self, rng: np.random.Generator, data: np.ndarray, k: int) -> np.ndarray:
+        k = min(k, len(data))
+        centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+        for _ in range(self.KMEANS_ITERATIONS):
+            distances = (centroids ** 2).sum(axis=1)[None, :] - 2 * data @ centroids.T
+            assignments = distances.argmin(axis=1)
+            counts = np.bincount(assignments, minlength=k)
+            for dim in range(data.shape[1]):
+                sums = np.bincount(assignments, weights=data[:, dim], minlength=k)
+                # Empty clusters keep their previous centroid
+                centroids[:, dim] = np.where(counts > 0, sums / np.maximum(counts, 1), centroids[:, dim])
+        return centroids
+
+    def _encode(self, state: dict, reduced: np.ndarray) -> np.ndarray:
+        if self.quantizer == "int8":
+            return np.clip(np.round((reduced - state["offset"]) / state["scale"]) - 128, -128, 127).astype(np.int8)
+
+        width = state["dimension"] // state["subvectors"]
+        codes = np.empty((len(reduced), state["subvectors"]), dtype=np.uint8)
+        for j, codebook in enumerate(state["codebooks"]):
+            sub = reduced[:, j * width:(j + 1) * width]
+            distances = (codebook ** 2).sum(axis=1)[None, :] - 2 * sub @ codebook.T
+            codes[:, j] = distances.argmin(axis=1)
+        return codes
+
+    def _fitted_shape(self, full_dimension: int, samples: int) -> tuple:
+        """Reduced dimension and sub-vector count that fit the data."""
+        if self.reduction == "none":
+            dimension = full_dimension
+        elif self.reduction == "pca":
+            # The SVD of n samples has at most n components
+            dimension = min(self.dimension, full_dimension, samples)
+        else:
+            dimension = min(self.dimension, full_dimension)
+        if self.quantizer != "pq":
+            return dimension, self.subvectors
+
+        subvectors = min(self.subvectors, dimension)
+        if self.reduction != "none":
+            # Drop trailing dimensions so every sub-vector has the same width
+            dimension -= dimension % subvectors
+        if dimension % subvectors != 0:
+            raise ValueError(f"Dimension {dimension} is not divisible into {subvectors} sub-vectors")
+        return dimension, subvectors
+
+    @contextmanager
+    def _write_lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with self.writer, open(os.path.join(self.directory, self.LOCK_FILE), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Another process may have fitted or encoded since we last looked
+                self.refresh()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def fit(self) -> "CompressedIndex":
+        """Fit the reduction and quantizer on the exact index, encode every row and publish them."""
+        with self._write_lock():
+            generation, matrix, _, _ = self.exact_index.snapshot()
+            self._fit(generation, matrix)
+        return self
+
+    def _fit(self, generation: int, matrix: Optional[np.ndarray]) -> None:
+        if matrix is None or len(matrix) == 0:
+            raise ValueError("Cannot fit a compressed index on an empty index")
+        rng = np.random.default_rng(self.seed)
+        count, full_dimension = matrix.shape
+
+        sample_rows = np.sort(rng.choice(count, size=min(count, self.TRAIN_SAMPLE), replace=False))
+        sample = self._full_rows(matrix, sample_rows)
+        dimension, subvectors = self._fitted_shape(full_dimension, len(sample))
+        state = {
+            "fit": self.fit_id + 1,
+            "generation": generation,
+            "dimension": dimension,
+            "subvectors": subvectors,
+            "count": 0,
+            "json_bytes_per_vector": int(np.mean([len(json.dumps(row.tolist())) for row in sample[:100]])),
+        }
+
+        if self.reduction == "pca":
+            state["mean"] = sample.mean(axis=0)
+            _, _, vt = np.linalg.svd(sample - state["mean"], full_matrices=False)
+            components = vt[:dimension].astype(np.float32)
+            if self.quantizer == "pq":
+                # PCA puts most variance in the leading dimensions; a random rotation
+                # spreads it evenly over the sub-vectors so every codebook is useful
+                rotation, _ = np.linalg.qr(rng.standard_normal((dimension, dimension)))
+                components = rotation.astype(np.float32) @ components
+            state["components"] = components.astype(np.float32)
+
+        reduced = self._reduce(state, sample)
+        if self.quantizer == "int8":
+            state["offset"] = reduced.min(axis=0)
+            state["scale"] = np.maximum(reduced.max(axis=0) - state["offset"], 1e-12) / 255.0
+        else:
+            width = dimension // subvectors
+            state["codebooks"] = np.stack([
+                self._kmeans(rng, np.ascontiguousarray(reduced[:, j * width:(j + 1) * width]), self.PQ_CENTROIDS)
+                for j in range(subvectors)
+            ]).astype(np.float32)
+
+        np.savez(self.model_path(state["fit"]), **{name: state[name] for name in self.MODEL_ARRAYS if name in state})
+        open(self.codes_path(state["fit"]), "wb").close()
+        self._encode_rows(state, matrix)
+        self._publish(state)
+
+    def _encode_rows(self, state: dict, matrix: np.ndarray) -> None:
+        # Truncate anything left over from an interrupted encode, then write past the committed codes
+        row_bytes = self._code_width(state) * np.dtype(self.CODE_DTYPES[self.quantizer]).itemsize
+        total = len(matrix)
+        with open(self.codes_path(state["fit"]), "r+b") as file:
+            file.truncate(state["count"] * row_bytes)
+            file.seek(0, os.SEEK_END)
+            for start in range(state["count"], total, self.BLOCK_ROWS):
+                rows = self._full_rows(matrix, slice(start, min(start + self.BLOCK_ROWS, total)))
+                file.write(self._encode(state, self._reduce(state, rows)).tobytes())
+        state["count"] = total
+
+    def _publish(self, state: dict) -> None:
+        previous = self.fit_id if self.manifest_stamp else None
+        # Write then rename so readers never see a half-written manifest
+        temp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump({
+                "fit": state["fit"],
+                "generation": state["generation"],
+                "dimension": state["dimension"],
+                "subvectors": state["subvectors"],
+                "count": state["count"],
+                "json_bytes_per_vector": state["json_bytes_per_vector"],
+                "settings": self.settings,
+            }, file)
+        os.replace(temp_path, self.manifest_path)
+        self.load()
+        # Processes that still map the old codes keep them until they reload
+        if previous is not None and previous != state["fit"]:
+            for path in [self.model_path(previous), self.codes_path(previous)]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def sync(self) -> bool:
+        """
+        Write path: encode rows appended to the exact index since the last sync,
+        or fit from scratch when there is no fit for its current generation and it
+        has at least MIN_FIT_ROWS rows. Returns whether compressed search is in use.
+        """
+        with self._write_lock():
+            generation, matrix, _, _ = self.exact_index.snapshot()
+            rows = len(matrix) if matrix is not None else 0
+            state = self.state
+            if not self._ready(state, generation, rows):
+                if rows < self.MIN_FIT_ROWS:
+                    return False
+                self._fit(generation, matrix)
+                return True
+            if rows > state["count"]:
+                state = dict(state)
+                self._encode_rows(state, matrix)
+                self._publish(state)
+            return True
+
+    def _snapshot(self) -> tuple:
+        with self.lock:
+            self.refresh()
+            state = self.state
+        return (state,) + self.exact_index.snapshot()
+
+    def approximate_scores(self, query: np.ndarray, state: Optional[dict] = None) -> np.ndarray:
+        """Asymmetric scores: the uncompressed (reduced) query against every code."""
+        return self.approximate_scores_batch(query[None, :], state)[0]
+
+    def approximate_scores_batch(self, queries: np.ndarray, state: Optional[dict] = None) -> np.ndarray:
+        """Asymmetric scores of several queries, reading the codes once for all of them."""
+        state = state or self.state
+        count, codes = state["count"], state["codes"]
+        reduced = self._reduce_queries(state, queries)
+        scores = np.empty((len(queries), count), dtype=np.float32)
+
+        if self.quantizer == "int8":
+            # x ~ offset + scale * (code + 128), so q.x = q.offset + (q * scale).(code + 128)
+            weights = (reduced * state["scale"]).astype(np.float32)
+            bias = reduced @ state["offset"] + 128.0 * weights.sum(axis=1)
+            for start in range(0, count, self.BLOCK_ROWS):
+                block = codes[start:start + self.BLOCK_ROWS].astype(np.float32)
+                scores[:, start:start + len(block)] = weights @ block.T + bias[:, None]
+            return scores
+
+        # Lookup tables for all queries: tables[j, c, q] = q_j . centroid c, laid out so
+        # each code gathers one contiguous row of scores for every query
+        width = state["dimension"] // state["subvectors"]
+        tables = np.ascontiguousarray(np.stack([
+            codebook @ reduced[:, j * width:(j + 1) * width].T for j, codebook in enumerate(state["codebooks"])
+        ]), dtype=np.float32)
+        block_rows = max(1, self.BLOCK_ROWS // len(queries))  # bounds the (rows, queries) temporaries
+        for start in range(0, count, block_rows):
+            block = codes[start:start + block_rows]
+            block_scores = tables[0][block[:, 0]]
+            for j in range(1, state["subvectors"]):
+                block_scores += tables[j][block[:, j]]
+            scores[:, start:start + len(block)] = block_scores.T
+        return scores
+
+    def search_rows(self, query_embeddings: List[List[float]], top_k: int = 5, rerank: Optional[int] = None, snapshot: Optional[tuple] = None) -> List[List[tuple]]:
+        """
+        Rows and full-precision similarities of the `top_k` best matches of each query.
+        `rerank` candidates per query from the codes are re-scored (default:
+        rerank_factor * top_k); the candidates of all queries are re-scored together.
+        """
+        state, generation, matrix = (snapshot or self._snapshot())[:3]
+        if matrix is None or len(query_embeddings) == 0:
+            return [[] for _ in query_embeddings]
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+
+        if not self._ready(state, generation, len(matrix)):
+            # No fit for this index yet: search the memory map exactly
+            scores = self.exact_index.scores(queries, matrix)
+            indices = ExactSearchIndex.top_k_indices(scores, top_k)
+            return [[(int(i), float(row_scores[i])) for i in row_indices] for row_scores, row_indices in zip(scores, indices)]
+
+        rerank = min(state["count"], rerank or self.rerank_factor * top_k)
+        candidates = ExactSearchIndex.top_k_indices(self.approximate_scores_batch(queries, state), rerank)
+        # Rows appended after the last sync have no codes yet and are always re-scored
+        rows = np.union1d(candidates.ravel(), np.arange(state["count"], len(matrix)))
+
+        # Re-score only the candidate rows at full precision, all queries in one product
+        exact_scores = self.exact_index.scores(queries, matrix[rows])
+        best = ExactSearchIndex.top_k_indices(exact_scores, top_k)
+        return [
+            [(int(rows[i]), float(row_scores[i])) for i in row_best]
+            for row_scores, row_best in zip(exact_scores, best)
+        ]
+
+    def search(self, query_embedding: List[float], top_k: int = 5) -> List[Document]:
+        return self.search_batch([query_embedding], top_k)[0]
+
+    def search_batch(self, query_embeddings: List[List[float]], top_k: int = 5) -> List[List[Document]]:
+        # One snapshot for the whole batch, so every query sees the same rows
+        snapshot = self._snapshot()
+        _, _, _, offsets, documents = snapshot
+        return [
+            [
+                Document(**ExactSearchIndex.read_document(documents, offsets, row), similarity=similarity)
+                for row, similarity in matches
+            ]
+            for matches in self.search_rows(query_embeddings, top_k, snapshot=snapshot)
+        ]
+
+    def memory_report(self) -> dict:
+        """Bytes per vector and in total for the full float32 vectors and the compressed form."""
+        state = self.state or {}
+        count = state.get("count", 0)
+        full_bytes = (self.exact_index.dimension or 0) * 4
+        codes = state.get("codes")
+        code_bytes = codes.shape[1] * codes.itemsize if codes is not None else 0
+        model_bytes = sum(state[name].nbytes for name in self.MODEL_ARRAYS if name in state)
+        return {
+            "vectors": count,
+            "full_bytes_per_vector": full_bytes,
+            "json_bytes_per_vector": state.get("json_bytes_per_vector"),  # embeddings as JSON text, as the DAO stores them
+            "code_bytes_per_vector": code_bytes,
+            "full_total_bytes": full_bytes * count,
+            "compressed_total_bytes": code_bytes * count + model_bytes,
+            "reduction_factor": full_bytes / code_bytes if code_bytes else None,
+        }
+
+    def recall_report(self, query_embeddings: List[List[float]], top_k: int = 5, reference: Optional[List[List[int]]] = None) -> dict:
+        """
+        Recall@k of the compressed search, with and without re-scoring, against
+        `reference` ids (e.g. from match_documents) or else against exact search.
+        """
+        if reference is None:
+            reference = [[doc.id for doc in docs] for docs in self.exact_index.search_batch(query_embeddings, top_k)]
+
+        def recall(results):
+            hits = sum(len(set(r) & set(ref)) for r, ref in zip(results, reference))
+            return hits / max(1, sum(len(ref) for ref in reference))
+
+        reranked = [[doc.id for doc in self.search(q, top_k)] for q in query_embeddings]
+        codes_only = []
+        if self.state is not None:
+            for q in query_embeddings:
+                query = np.asarray(q, dtype=np.float32)
+                query = query / (np.linalg.norm(query) or 1)
+                rows = ExactSearchIndex.top_k_indices(self.approximate_scores(query)[None, :], top_k)[0]
+                codes_only.append([self.exact_index.document(int(row))["id"] for row in rows])
+
+        return {
+            f"recall@{top_k}": recall(reranked),
+            f"recall@{top_k}_codes_only": recall(codes_only) if codes_only else None,
+        }
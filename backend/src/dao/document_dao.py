@@ -1,66 +1,182 @@
 import numpy as np
 import json
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
-from src.config.db import supabase
+from src.config.db import get_client
+from src.config.models import VECTOR_SEARCH_BACKEND, VECTOR_INDEX_DIR, VECTOR_INDEX_DTYPE, VECTOR_COMPRESSION_REDUCTION, VECTOR_COMPRESSION_DIMENSION, VECTOR_COMPRESSION_QUANTIZER
 from src.models.document import Document, DocumentCreate
+from src.dao.vector_index import ExactSearchIndex
+from src.dao.compressed_index import CompressedIndex
+from src.utils.rate_limiter import call_with_limit
 #Vector search, batch operations, error handling
 class DocumentDAO:
+    BATCH_SEARCH_WORKERS = 8  # concurrent match_documents calls for batch search
+    PAGE_SIZE = 1000  # Supabase returns at most 1000 rows per select
+    CHUNK_ID_PAGE_SIZE = 100  # chunk ids per "in" filter
+    
+    _exact_index = None
+    _compressed_index = None
+    
+    @staticmethod
+    def use_exact_index() -> bool:
+        # The compressed index re-scores its candidates with the exact index
+        return VECTOR_SEARCH_BACKEND in ("exact", "compressed")
+    
+    @staticmethod
+    def use_compressed_index() -> bool:
+        return VECTOR_SEARCH_BACKEND == "compressed"
+    
+    @staticmethod
+    def get_exact_index() -> ExactSearchIndex:
+        """Load the local exact search index, building it from the database on first use."""
+        if DocumentDAO._exact_index is None:
+            index = ExactSearchIndex(VECTOR_INDEX_DIR, dtype=VECTOR_INDEX_DTYPE)
+            if not index.exists() or not index.compatible:
+                print("Building exact search index from database...")
+                index.build(DocumentDAO.get_all_documents())
+            print(f"Exact search index loaded with {len(index)} chunks")
+            DocumentDAO._exact_index = index
+        return DocumentDAO._exact_index
+    
+    @staticmethod
+    def get_local_index():
+        """The local index that serves searches: compressed or exact."""
+        if not DocumentDAO.use_compressed_index():
+            return DocumentDAO.get_exact_index()
+        if DocumentDAO._compressed_index is None:
+            index = CompressedIndex(
+                DocumentDAO.get_exact_index(),
+                reduction=VECTOR_COMPRESSION_REDUCTION,
+                dimension=VECTOR_COMPRESSION_DIMENSION,
+                quantizer=VECTOR_COMPRESSION_QUANTIZER
+            )
+            # Maps the published codes; searches are exact until sync_local_index has fitted them
+            print(f"Compressed index loaded: {index.memory_report()}")
+            DocumentDAO._compressed_index = index
+        return DocumentDAO._compressed_index
+    
+    @staticmethod
+    def sync_local_index() -> None:
+        """
+        Load the local index and bring the compressed codes up to date with it.
+        May fit the compressed index, so call it on startup and after writes, never per query.
+        """
+        index = DocumentDAO.get_local_index()
+        if DocumentDAO.use_compressed_index():
+            try:
+                ready = index.sync()
+            except Exception as e:
+                print(f"Error syncing compressed index, searching exactly: {str(e)}")
+                return
+            print(f"Compressed index {'in use' if ready else 'not fitted yet, searching exactly'}: {index.memory_report()}")
+    
     @staticmethod
     def create_document(document: DocumentCreate) -> Document:
+        # Load (or build) the index before inserting, so a fresh build cannot already contain the new row
+        index = DocumentDAO.get_exact_index() if DocumentDAO.use_exact_index() else None
         data = document.dict()
         if data["embedding"]:
             # Convert list to string for storage
             data["embedding"] = json.dumps(data["embedding"])
         
-        response = supabase.table("documents").insert(data).execute()
+        response = call_with_limit("supabase", get_client().table("documents").insert(data).execute, max_retries=1)
         
         if response.data:
-            return Document(**response.data[0])
+            created = Document(**response.data[0])
+            if index is not None:
+                index.append([created])
+                DocumentDAO.sync_local_index()
+            return created
         raise Exception("Failed to create document")
     
     @staticmethod
     def create_documents(documents: List[DocumentCreate]) -> List[Document]:
+        # Load (or build) the index before inserting, so a fresh build cannot already contain the new rows
+        index = DocumentDAO.get_exact_index() if DocumentDAO.use_exact_index() else None
         data_list = [doc.dict() for doc in documents]
         for data in data_list:
             if data["embedding"]:
                 # Convert list to string for storage
                 data["embedding"] = json.dumps(data["embedding"])
         
-        response = supabase.table("documents").insert(data_list).execute()
+        response = call_with_limit("supabase", get_client().table("documents").insert(data_list).execute, max_retries=1)
         
         if response.data:
-            return [Document(**item) for item in response.data]
+            created = [Document(**item) for item in response.data]
+            if index is not None:
+                index.append(created)
+                DocumentDAO.sync_local_index()
+            return created
         raise Exception("Failed to create documents")
     
     @staticmethod
     def search_documents(query_embedding: List[float], top_k: int = 5) -> List[Document]:
+        if DocumentDAO.use_exact_index():
+            return DocumentDAO.get_local_index().search(query_embedding, top_k)
+        
         # Convert to numpy array for proper formatting
         query_embedding_np = np.array(query_embedding)
         
         # Perform vector search using Supabase rpc
-        response = supabase.rpc(
+        response = call_with_limit("supabase", get_client().rpc(
             "match_documents",
             {
                 "query_embedding": query_embedding_np.tolist(),
                 "match_count": top_k
             }
-        ).execute()
+        ).execute)
         
         if response.data:
             return [Document(**item) for item in response.data]
         return []
     
+    @staticmethod
+    def search_documents_batch(query_embeddings: List[List[float]], top_k: int = 5) -> List[List[Document]]:
+        if not query_embeddings:
+            return []
+        if DocumentDAO.use_exact_index():
+            # One matrix product for all queries on the exact index
+            return DocumentDAO.get_local_index().search_batch(query_embeddings, top_k)
+        # match_documents takes a single embedding, so issue the searches concurrently
+        with ThreadPoolExecutor(max_workers=min(DocumentDAO.BATCH_SEARCH_WORKERS, len(query_embeddings))) as executor:
+            return list(executor.map(lambda embedding: DocumentDAO.search_documents(embedding, top_k), query_embeddings))
+    
+    @staticmethod
+    def get_documents_by_chunk_ids(chunk_ids: List[str]) -> Dict[str, Document]:
+        documents = {}
+        if DocumentDAO.use_exact_index():
+            # Parent spans are kept in the local index, only ones it lacks go to the database
+            documents = DocumentDAO.get_exact_index().parent_documents(chunk_ids)
+            chunk_ids = [chunk_id for chunk_id in chunk_ids if chunk_id not in documents]
+        # Fetch in pages to keep the filter within URL length limits
+        for start in range(0, len(chunk_ids), DocumentDAO.CHUNK_ID_PAGE_SIZE):
+            page = chunk_ids[start:start + DocumentDAO.CHUNK_ID_PAGE_SIZE]
+            response = call_with_limit("supabase", get_client().table("documents").select("id, title, content, chunk_id, created_at").in_("chunk_id", page).execute)
+            for item in response.data or []:
+                documents.setdefault(item["chunk_id"], Document(**item))
+        return documents
+    
     @staticmethod
     def get_all_documents() -> List[Document]:
-        response = supabase.table("documents").select("*").execute()
-        
-        if response.data:
-            return [Document(**item) for item in response.data]
-        return []
+        documents = []
+        start = 0
+        # Page through the table, a single select is capped by the server
+        while True:
+            response = call_with_limit("supabase", get_client().table("documents").select("*").order("id").range(start, start + DocumentDAO.PAGE_SIZE - 1).execute)
+            if not response.data:
+                break
+            documents.extend(Document(**item) for item in response.data)
+            if len(response.data) < DocumentDAO.PAGE_SIZE:
+                break
+            start += DocumentDAO.PAGE_SIZE
+        return documents
     
     @staticmethod
     def delete_all_documents() -> bool:
-        response = supabase.table("documents").delete().neq("id", 0).execute()
+        response = call_with_limit("supabase", get_client().table("documents").delete().neq("id", 0).execute, max_retries=1)
+        
+        if DocumentDAO.use_exact_index():
+            DocumentDAO.get_exact_index().clear()
         
         if response.data:
             return True
@@ -0,0 +1,384 @@
+import os
+import json
+import mmap
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from src.models.document import Document
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run a single worker
+    fcntl = None
+#Exact (brute-force) vector search over a memory-mapped embedding matrix, reference for ANN recall
+class ExactSearchIndex:
+    """
+    Keeps every chunk embedding in one contiguous, memory-mapped matrix with
+    L2-normalized rows, so cosine similarity is a single matrix product.
+    Scores match the `similarity` column returned by `match_documents`.
+
+    The index can be shared by several worker processes. Everything is read
+    through memory maps, so the page cache holds a single copy for all of them.
+    One process writes at a time (under a file lock) and publishes its rows by
+    atomically replacing the manifest; readers remap when the manifest changes.
+    Rebuilding or clearing starts a new generation of files instead of
+    truncating ones other processes may still have mapped.
+
+    Parent spans (chunks stored without an embedding) are kept in a separate
+    JSONL file with no matrix row and are looked up by chunk id.
+    """
+    DTYPES = {
+        "float32": np.float32,
+        "float16": np.float16,
+        "int8": np.int8,
+    }
+    INT8_SCALE = 127.0  # normalized values lie in [-1, 1]
+    BLOCK_ROWS = 65536  # rows converted to float32 at a time for float16/int8 storage
+
+    MANIFEST_FILE = "manifest.json"
+    LOCK_FILE = "index.lock"
+
+    def __init__(self, directory: str, dtype: str = "float32"):
+        if dtype not in self.DTYPES:
+            raise ValueError(f"Unsupported index dtype '{dtype}', expected one of {list(self.DTYPES)}")
+        self.directory = directory
+        self.dtype = dtype
+        self.generation = 0
+        self.dimension = None
+        self.count = 0
+        self.matrix = None
+        self.offsets = None
+        self.documents = None
+        self.parents = None
+        self.parents_bytes = 0
+        self.parent_offsets = {}  # chunk_id -> (start, end) in the parents file
+        self.parents_indexed = (None, 0)  # (generation, bytes) already scanned into parent_offsets
+        self.manifest_stamp = None
+        self.compatible = True
+        self.lock = threading.RLock()
+        self.load()
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, self.MANIFEST_FILE)
+
+    @property
+    def matrix_path(self) -> str:
+        return os.path.join(self.directory, f"embeddings.{self.generation}.bin")
+
+    @property
+    def documents_path(self) -> str:
+        return os.path.join(self.directory, f"documents.{self.generation}.jsonl")
+
+    @property
+    def offsets_path(self) -> str:
+        return os.path.join(self.directory, f"offsets.{self.generation}.bin")
+
+    @property
+    def parents_path(self) -> str:
+        return os.path.join(self.directory, f"parents.{self.generation}.jsonl")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def exists(self) -> bool:
+        """Whether an index has been written to the directory."""
+        return self.manifest_stamp is not None
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+    def load(self) -> None:
+        """Map the on-disk matrix and chunk metadata, if an index exists."""
+        with self.lock:
+            while True:
+                stamp = self._stamp()
+                if stamp is None:
+                    return
+
+                with open(self.manifest_path, "r", encoding="utf-8") as file:
+                    manifest = json.load(file)
+                self.manifest_stamp = stamp
+                self.generation = manifest["generation"]
+
+                self.compatible = manifest["dtype"] == self.dtype
+                if not self.compatible:
+                    print(f"Index dtype changed from {manifest['dtype']} to {self.dtype}, index must be rebuilt")
+                    self.count = 0
+                    self.parents_bytes = 0
+                    self._map_files()
+                    return
+
+                self.dimension = manifest["dimension"]
+                self.count = manifest["count"]
+                self.parents_bytes = manifest.get("parents_bytes", 0)
+                try:
+                    self._map_files()
+                    return
+                except FileNotFoundError:
+                    # Another process started a new generation in the meantime, read the new manifest
+                    continue
+
+    def refresh(self) -> None:
+        """Pick up rows published by other processes since the last load."""
+        if self._stamp() != self.manifest_stamp:
+            self.load()
+
+    def _map_files(self) -> None:
+        self._map_parents()
+        # Only the first `count` rows are committed by the manifest; anything
+        # past them belongs to an append in progress and is never mapped
+        if self.count == 0:
+            self.matrix = None
+            self.offsets = None
+            self.documents = None
+            return
+        self.matrix = np.memmap(
+            self.matrix_path,
+            dtype=self.DTYPES[self.dtype],
+            mode="r",
+            shape=(self.count, self.dimension)
+        )
+        self.offsets = np.memmap(self.offsets_path, dtype=np.int64, mode="r", shape=(self.count + 1,))
+        with open(self.documents_path, "rb") as file:
+            self.documents = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _map_parents(self) -> None:
+        # Like the rows, only the first `parents_bytes` bytes are committed
+        if self.parents_indexed[0] != self.generation or self.parents_indexed[1] > self.parents_bytes:
+            self.parent_offsets = {}
+            self.parents_indexed = (self.generation, 0)
+        if self.parents_bytes == 0:
+            self.parents = None
+            return
+        with open(self.parents_path, "rb") as file:
+            self.parents = mmap.mmap(file.fileno(), self.parents_bytes, access=mmap.ACCESS_READ)
+
+        # Only scan the lines published since the last load
+        start = self.parents_indexed[1]
+        while start < self.parents_bytes:
+            end = self.parents.find(b"\n", start, self.parents_bytes) + 1
+            self.parent_offsets[json.loads(self.parents[start:end])["chunk_id"]] = (start, end)
+            start = end
+        self.parents_indexed = (self.generation, self.parents_bytes)
+
+    def parent_documents(self, chunk_ids: List[str]) -> Dict[str, Document]:
+        """Parent spans stored in the index, by chunk id. Unknown ids are left out."""
+        with self.lock:
+            self.refresh()
+            return {
+                chunk_id: Document(**json.loads(self.parents[start:end]))
+                for chunk_id in chunk_ids
+                if chunk_id in self.parent_offsets
+                for start, end in [self.parent_offsets[chunk_id]]
+            }
+
+    @staticmethod
+    def read_document(documents: mmap.mmap, offsets: np.ndarray, row: int) -> dict:
+        """Metadata of one row of a snapshot, read from the memory-mapped documents file."""
+        return json.loads(documents[offsets[row]:offsets[row + 1]])
+
+    def document(self, row: int) -> dict:
+        """Metadata of one indexed chunk, read from the memory-mapped documents file."""
+        return self.read_document(self.documents, self.offsets, row)
+
+    def snapshot(self) -> tuple:
+        """
+        (generation, matrix, offsets, documents) of the committed rows. The maps stay
+        valid after later writes, so a snapshot can be searched without the lock.
+        """
+        with self.lock:
+            self.refresh()
+            return self.generation, self.matrix, self.offsets, self.documents
+
+    @contextmanager
+    def _write_lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock, open(os.path.join(self.directory, self.LOCK_FILE), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Another process may have written since we last looked
+                self.refresh()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _encode(self, embeddings: np.ndarray) -> np.ndarray:
+        """Normalize rows and convert them to the storage dtype."""
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        normalized = embeddings / np.where(norms == 0, 1, norms)
+        if self.dtype == "int8":
+            return np.round(normalized * self.INT8_SCALE).astype(np.int8)
+        return normalized.astype(self.DTYPES[self.dtype])
+
+    def _write_manifest(self) -> None:
+        # Write then rename so readers never see a half-written manifest
+        temp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump({
+                "generation": self.generation,
+                "dtype": self.dtype,
+                "dimension": self.dimension,
+                "count": self.count,
+                "parents_bytes": self.parents_bytes,
+            }, file)
+        os.replace(temp_path, self.manifest_path)
+        self.manifest_stamp = self._stamp()
+
+    def _start_generation(self) -> None:
+        previous = [self.matrix_path, self.documents_path, self.offsets_path, self.parents_path] if self.manifest_stamp else []
+        self.generation += 1
+        self.compatible = True
+        self.count = 0
+        self.parents_bytes = 0
+        self.dimension = None
+        open(self.matrix_path, "wb").close()
+        open(self.documents_path, "wb").close()
+        open(self.parents_path, "wb").close()
+        with open(self.offsets_path, "wb") as file:
+            file.write(np.zeros(1, dtype=np.int64).tobytes())
+        self._write_manifest()
+        self._map_files()
+        # Processes that still map the old files keep them until they remap
+        for path in previous:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def clear(self) -> None:
+        """Remove all rows from the index."""
+        with self._write_lock():
+            self._start_generation()
+
+    def build(self, documents: List[Document]) -> int:
+        """Rebuild the index from scratch. Returns the number of indexed chunks."""
+        with self._write_lock():
+            self._start_generation()
+            return self._append(documents)
+
+    def append(self, documents: List[Document]) -> int:
+        """
+        Append documents to the index: chunks with an embedding as searchable rows,
+        parent spans without one as metadata only. Returns the number of searchable chunks.
+        """
+        with self._write_lock():
+            if self.manifest_stamp is None or not self.compatible:
+                self._start_generation()
+            return self._append(documents)
+
+    def _append(self, documents: List[Document]) -> int:
+        parents = [doc for doc in documents if not doc.embedding and doc.chunk_id]
+        documents = [doc for doc in documents if doc.embedding]
+        if parents:
+            self._append_parents(parents)
+        if not documents:
+            if parents:
+                self._write_manifest()
+                self._map_files()
+            return 0
+
+        embeddings = np.asarray([doc.embedding for doc in documents], dtype=np.float32)
+        if self.dimension is None:
+            self.dimension = embeddings.shape[1]
+        if embeddings.shape[1] != self.dimension:
+            raise ValueError(f"Embedding has {embeddings.shape[1]} dimensions, index expects {self.dimension}")
+
+        lines = [self._document_line(doc) for doc in documents]
+        start_offset = int(self.offsets[-1]) if self.count else 0
+        offsets = start_offset + np.cumsum([len(line) for line in lines], dtype=np.int64)
+
+        # Truncate anything left over from an interrupted append, then write past the committed rows
+        row_bytes = self.dimension * np.dtype(self.DTYPES[self.dtype]).itemsize
+        with open(self.matrix_path, "r+b") as file:
+            file.truncate(self.count * row_bytes)
+            file.seek(0, os.SEEK_END)
+            file.write(self._encode(embeddings).tobytes())
+        with open(self.documents_path, "r+b") as file:
+            file.truncate(start_offset)
+            file.seek(0, os.SEEK_END)
+            file.write(b"".join(lines))
+        with open(self.offsets_path, "r+b") as file:
+            file.truncate((self.count + 1) * 8)
+            file.seek(0, os.SEEK_END)
+            file.write(offsets.tobytes())
+
+        # Publishing the manifest is what makes the new rows visible
+        self.count += len(documents)
+        self._write_manifest()
+        self._map_files()
+        return len(documents)
+
+    @staticmethod
+    def _document_line(doc: Document) -> bytes:
+        return (json.dumps({
+            "id": doc.id,
+            "title": doc.title,
+            "content": doc.content,
+            "chunk_id": doc.chunk_id,
+            "created_at": doc.created_at.isoformat(),
+        }) + "\n").encode("utf-8")
+
+    def _append_parents(self, parents: List[Document]) -> None:
+        # Committed by the manifest written at the end of the append
+        lines = b"".join(self._document_line(doc) for doc in parents)
+        with open(self.parents_path, "r+b") as file:
+            file.truncate(self.parents_bytes)
+            file.seek(0, os.SEEK_END)
+            file.write(lines)
+        self.parents_bytes += len(lines)
+
+    def scores(self, query_embeddings: np.ndarray, matrix: Optional[np.ndarray] = None) -> np.ndarray:
+        """Cosine similarity between each query row and every indexed chunk."""
+        matrix = self.matrix if matrix is None else matrix
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+
+        if matrix.dtype == np.float32:
+            return queries @ matrix.T
+
+        # float16/int8 have no BLAS kernels, so upcast the matrix block by block
+        scale = 1.0 / self.INT8_SCALE if matrix.dtype == np.int8 else 1.0
+        result = np.empty((len(queries), len(matrix)), dtype=np.float32)
+        for start in range(0, len(matrix), self.BLOCK_ROWS):
+            block = matrix[start:start + self.BLOCK_ROWS].astype(np.float32)
+            result[:, start:start + len(block)] = queries @ block.T
+        if scale != 1.0:
+            result *= scale
+        return result
+
+    @staticmethod
+    def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+        """Indices of the `top_k` highest scores in each row, best first."""
+        top_k = min(top_k, scores.shape[1])
+        if top_k < scores.shape[1]:
+            candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        else:
+            candidates = np.tile(np.arange(scores.shape[1]), (len(scores), 1))
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1, kind="stable")
+        return np.take_along_axis(candidates, order, axis=1)
+
+    def search_batch(self, query_embeddings: List[List[float]], top_k: int = 5) -> List[List[Document]]:
+        """Search several queries with one matrix product."""
+        # Take a consistent snapshot, then search without holding the lock
+        _, matrix, offsets, documents = self.snapshot()
+        if matrix is None or len(query_embeddings) == 0:
+            return [[] for _ in query_embeddings]
+
+        scores = self.scores(query_embeddings, matrix)
+        indices = self.top_k_indices(scores, top_k)
+
+        return [
+            [Document(**self.read_document(documents, offsets, i), similarity=float(row_scores[i])) for i in row_indices]
+            for row_scores, row_indices in zip(scores, indices)
+        ]
+
+    def search(self, query_embedding: List[float], top_k: int = 5) -> List[Document]:
+        return self.search_batch([query_embedding], top_k)[0]
@@ -11,7 +11,8 @@ app = create_app()
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
-    debug = os.environ.get("DEBUG", "true").lower() == "true"
+    # Development entry point; production serving goes through run.py / gunicorn
+    debug = os.environ.get("DEBUG", "false").lower() == "true"
     
     uvicorn.run(
         app,
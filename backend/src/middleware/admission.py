@@ -0,0 +1,99 @@
+# src/middleware/admission.py
+import asyncio
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from src.config.models import generation_model, FALLBACK_MODELS
+from src.utils.rate_limiter import get_limiter
+
+# Only query endpoints are admission controlled
+ADMISSION_PATHS = ("/api/rag/query", "/api/rag/query/batch")
+
+MAX_IN_FLIGHT = 16  # queries processed at the same time
+MAX_QUEUED = 64  # queries waiting for a slot before new ones are shed
+QUEUE_TIMEOUT = 10.0  # seconds a query may wait for a slot
+MAX_BACKEND_WAIT = 5.0  # seconds; a backend whose limiter would block longer is saturated
+# Answers generated at the same time across /query and every batch; a batch holds one
+# admission slot but generates up to max_concurrency answers, so generations are bounded separately
+MAX_GENERATIONS = MAX_IN_FLIGHT
+
+_slots = None
+_queued = 0
+_generations = None
+
+def generation_slots() -> asyncio.Semaphore:
+    """
+    Semaphore shared by every answer generated in this worker.
+    """
+    global _generations
+    if _generations is None:
+        _generations = asyncio.Semaphore(MAX_GENERATIONS)
+    return _generations
+
+def backend_wait() -> float:
+    """
+    Seconds until a query could reach every backend it needs: the embedding
+    model, the database and a generation model (the least throttled Groq model,
+    or Ollama, which answers when every Groq model is throttled).
+    """
+    groq_wait = min(get_limiter(f"groq:{model}").expected_wait() for model in [generation_model] + FALLBACK_MODELS)
+    generation_wait = min(groq_wait, get_limiter("ollama-chat").expected_wait())
+    return max(get_limiter("ollama-embed").expected_wait(), get_limiter("supabase").expected_wait(), generation_wait)
+
+def overloaded_response(reason: str, retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"message": "Server is busy, please retry later.", "detail": reason},
+        headers={"Retry-After": str(max(1, int(retry_after + 0.5)))}
+    )
+
+async def admission_control(request: Request, call_next):
+    """
+    Queue query requests when all slots are busy and shed them when the queue is
+    full, the wait is too long or the backends are saturated.
+    """
+    global _slots, _queued
+    if request.url.path not in ADMISSION_PATHS:
+        return await call_next(request)
+
+    if _slots is None:
+        _slots = asyncio.Semaphore(MAX_IN_FLIGHT)
+
+    wait_time = backend_wait()
+    if wait_time > MAX_BACKEND_WAIT:
+        return overloaded_response("Backends are saturated.", wait_time)
+
+    if _slots.locked() and _queued >= MAX_QUEUED:
+        return overloaded_response("Too many queued requests.", QUEUE_TIMEOUT)
+
+    _queued += 1
+    try:
+        await asyncio.wait_for(_slots.acquire(), timeout=QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        return overloaded_response("Timed out waiting for a free slot.", QUEUE_TIMEOUT)
+    finally:
+        _queued -= 1
+
+    try:
+        response = await call_next(request)
+    except Exception:
+        _slots.release()
+        raise
+
+    # Streaming responses keep their slot until the body has been sent
+    body_iterator = response.body_iterator
+
+    async def release_after_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            _slots.release()
+
+    response.body_iterator = release_after_body()
+    return response
+
+def setup_admission_control(app: FastAPI):
+    """
+    Set up admission control for the FastAPI application.
+    """
+    app.middleware("http")(admission_control)
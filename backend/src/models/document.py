@@ -1,4 +1,4 @@
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, Field, field_validator
 from typing import Optional, List
 from datetime import datetime
 import json
@@ -15,6 +15,7 @@ class DocumentCreate(DocumentBase):
 class Document(DocumentBase):
     id: int
     created_at: datetime
+    similarity: Optional[float] = None
     
     @field_validator('embedding', mode='before')
     @classmethod
@@ -37,4 +38,16 @@ class QueryRequest(BaseModel):
 class QueryResponse(BaseModel):
     query: str
     response: str
-    sources: List[str]
\ No newline at end of file
+    sources: List[str]
+
+MAX_BATCH_QUERIES = 256  # bounds the single embedding call and the n x n similarity matrix
+MAX_BATCH_TOP_K = 20  # parent spans per answer; retrieval fetches CHILD_CANDIDATES_PER_PARENT times as many chunks
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str] = Field(min_length=1, max_length=MAX_BATCH_QUERIES)
+    top_k: int = Field(default=5, ge=1, le=MAX_BATCH_TOP_K)
+    max_concurrency: int = Field(default=4, ge=1, le=32)
+
+class BatchQueryResult(QueryResponse):
+    index: int
+    duplicate_of: Optional[int] = None
\ No newline at end of file
@@ -1,30 +1,73 @@
 import os
-import time
 import json
+import uuid
+import asyncio
 import numpy as np
-from typing import List, Dict, Any
-from src.config.models import groq_client, generation_model, text_splitter, EMBEDDING_MODEL, EMBEDDING_DIMENSION, FALLBACK_MODELS
+from typing import List, Dict, Any, Tuple, AsyncIterator
+from src.config.models import groq_client, generation_model, text_splitter, embedding_cache, EMBEDDING_MODEL, EMBEDDING_DIMENSION, FALLBACK_MODELS, CHILD_CHUNK_SIZE
 from src.dao.document_dao import DocumentDAO
-from src.models.document import DocumentCreate, QueryRequest, QueryResponse
+from src.models.document import Document as DocumentModel, DocumentCreate, QueryRequest, QueryResponse, BatchQueryRequest, BatchQueryResult
+from src.utils.text_processing import normalize_query, sentence_windows, parent_chunk_id, child_chunk_id, get_parent_chunk_id
+from src.utils.prompts import build_messages, count_tokens
+from src.utils.rate_limiter import call_with_limit, get_limiter
+from src.middleware.admission import generation_slots
 from langchain.docstore.document import Document
 import traceback
 import ollama
 # Implements document processing, querying, and response generation
 class RAGService:
-    # Rate limiting constants
-    REQUEST_DELAY = 0.5  # seconds between requests
+    # Retry constants, pacing is handled by the shared per-backend rate limiters
     MAX_RETRIES = 3
-    RETRY_DELAY = 5.0  # seconds to wait after error
+    RETRY_BACKOFF = 0.5  # seconds before the first retry of a non rate-limit error, doubled each retry
+    GROQ_MAX_WAIT = 2.0  # seconds; fall through to the next model rather than wait longer
+    
+    # Batch query constants
+    BATCH_DEDUP_THRESHOLD = 0.98  # cosine similarity above which queries share one answer
+    
+    # Child chunks retrieved per requested parent span, to leave room for merging hits on one parent
+    CHILD_CANDIDATES_PER_PARENT = 3
+    
+    # How long Ollama keeps the generation model (and its prompt cache) loaded
+    OLLAMA_KEEP_ALIVE = "30m"
 #Embedding generation, document chunking, similarity search, response generation with fallback 
+    @staticmethod
+    def get_cached_embeddings(texts: List[str]) -> Dict[str, List[float]]:
+        """Look up embeddings in the shared on-disk cache, if enabled"""
+        if embedding_cache is None:
+            return {}
+        try:
+            return embedding_cache.get_many(texts)
+        except Exception as e:
+            print(f"Error reading embedding cache: {str(e)}")
+            return {}
+    
+    @staticmethod
+    def cache_embeddings(texts: List[str], embeddings: List[List[float]]) -> None:
+        """Store embeddings in the shared on-disk cache, if enabled"""
+        if embedding_cache is None:
+            return
+        try:
+            embedding_cache.put_many(texts, embeddings)
+        except Exception as e:
+            print(f"Error writing embedding cache: {str(e)}")
+    
     @staticmethod
     def generate_embedding(text: str) -> List[float]:
         """Generate embedding using Ollama"""
+        cached = RAGService.get_cached_embeddings([text])
+        if text in cached:
+            return cached[text]
+        
         try:
             print(f"Generating embedding for text (length: {len(text)})")
             # Use Ollama to generate embedding
-            response = ollama.embeddings(
+            response = call_with_limit(
+                "ollama-embed",
+                ollama.embeddings,
                 model=EMBEDDING_MODEL,
-                prompt=text
+                prompt=text,
+                max_retries=RAGService.MAX_RETRIES,
+                retry_backoff=RAGService.RETRY_BACKOFF
             )
             embedding = response["embedding"]
             print(f"Successfully generated embedding with {len(embedding)} dimensions")
@@ -32,7 +75,8 @@ class RAGService:
             # Validate embedding dimensions
             if len(embedding) != EMBEDDING_DIMENSION:
                 print(f"Warning: Embedding has {len(embedding)} dimensions, expected {EMBEDDING_DIMENSION}")
-                
+            
+            RAGService.cache_embeddings([text], [embedding])
             return embedding
         except Exception as e:
             print(f"Error generating embedding: {str(e)}")
@@ -40,24 +84,68 @@ class RAGService:
             raise
     
     @staticmethod
-    def generate_response_with_groq(prompt: str) -> str:
+    def generate_embeddings(texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for several texts in a single Ollama call"""
+        cached = RAGService.get_cached_embeddings(texts)
+        missing = list(dict.fromkeys(text for text in texts if text not in cached))
+        if not missing:
+            return [cached[text] for text in texts]
+        
+        try:
+            print(f"Generating embeddings for {len(missing)} texts ({len(texts) - len(missing)} cached)")
+            response = call_with_limit(
+                "ollama-embed",
+                ollama.embed,
+                model=EMBEDDING_MODEL,
+                input=missing,
+                max_retries=RAGService.MAX_RETRIES,
+                retry_backoff=RAGService.RETRY_BACKOFF
+            )
+            embeddings = response["embeddings"]
+            print(f"Successfully generated {len(embeddings)} embeddings")
+            
+            # Validate embedding dimensions
+            for embedding in embeddings:
+                if len(embedding) != EMBEDDING_DIMENSION:
+                    print(f"Warning: Embedding has {len(embedding)} dimensions, expected {EMBEDDING_DIMENSION}")
+                    break
+            
+            RAGService.cache_embeddings(missing, embeddings)
+            cached.update(zip(missing, embeddings))
+            return [cached[text] for text in texts]
+        except Exception as e:
+            print(f"Error generating embeddings: {str(e)}")
+            print(traceback.format_exc())
+            raise
+    
+    @staticmethod
+    def generate_response_with_groq(messages: List[Dict[str, str]]) -> str:
         """Generate response using Groq with fallback models"""
         # Try primary model first
         models_to_try = [generation_model] + FALLBACK_MODELS
         
         for model in models_to_try:
+            # Move on to a fallback model instead of waiting for a throttled one
+            wait_time = get_limiter(f"groq:{model}").expected_wait()
+            if wait_time > RAGService.GROQ_MAX_WAIT:
+                print(f"Skipping Groq model {model}: rate limited for another {wait_time:.1f}s")
+                continue
+            
             try:
                 print(f"Trying Groq model: {model}")
-                response = groq_client.chat.completions.create(
+                response = call_with_limit(
+                    f"groq:{model}",
+                    groq_client.chat.completions.create,
                     model=model,
-                    messages=[
-                        {"role": "system", "content": "You are a helpful assistant that provides accurate information about India."},
-                        {"role": "user", "content": prompt}
-                    ],
+                    messages=messages,
                     temperature=0.2,
-                    max_tokens=1024
+                    max_tokens=1024,
+                    max_retries=1,
+                    timeout=RAGService.GROQ_MAX_WAIT
                 )
                 print(f"Successfully generated response using Groq model: {model}")
+                if response.usage:
+                    print(f"Groq usage: {response.usage.prompt_tokens} prompt tokens, {response.usage.completion_tokens} completion tokens")
                 return response.choices[0].message.content
             except Exception as e:
                 error_message = str(e)
@@ -71,37 +159,46 @@ class RAGService:
                 # For other errors, continue to next model
                 continue
         
-        # If all Groq models fail, return None to fall back to Ollama
+        # If all Groq models fail or are throttled, return None to fall back to Ollama
         return None
     
     @staticmethod
-    def generate_response_with_ollama(prompt: str) -> str:
+    def generate_response_with_ollama(messages: List[Dict[str, str]]) -> str:
         """Generate response using Ollama"""
         try:
             print("Falling back to Ollama for generation")
-            response = ollama.chat(
+            response = call_with_limit(
+                "ollama-chat",
+                ollama.chat,
                 model="llama3",  # Use a reliable model
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that provides accurate information about India."},
-                    {"role": "user", "content": prompt}
-                ]
+                messages=messages,
+                keep_alive=RAGService.OLLAMA_KEEP_ALIVE,  # keep the model loaded so the cached prefix is reused
+                max_retries=RAGService.MAX_RETRIES,
+                retry_backoff=RAGService.RETRY_BACKOFF
             )
             print("Successfully generated response using Ollama")
+            if response.get('prompt_eval_count') is not None:
+                print(f"Ollama evaluated {response['prompt_eval_count']} prompt tokens")
             return response['message']['content']
         except Exception as e:
             print(f"Error generating response with Ollama: {str(e)}")
             return f"I apologize, but I'm currently experiencing technical difficulties. Error: {str(e)}"
     
     @staticmethod
-    def generate_response(prompt: str) -> str:
+    def generate_response(messages: List[Dict[str, str]]) -> str:
         """Generate response using Groq or Ollama"""
+        try:
+            print(f"Prompt size: {count_tokens(messages)} tokens")
+        except Exception as e:
+            print(f"Could not count prompt tokens: {str(e)}")
+        
         # First try Groq
-        groq_response = RAGService.generate_response_with_groq(prompt)
+        groq_response = RAGService.generate_response_with_groq(messages)
         if groq_response:
             return groq_response
         
         # Fall back to Ollama
-        return RAGService.generate_response_with_ollama(prompt)
+        return RAGService.generate_response_with_ollama(messages)
     
     @staticmethod
     def process_document(file_path: str, title: str) -> bool:
@@ -124,58 +221,51 @@ class RAGService:
             # Create a LangChain document
             doc = Document(page_content=text, metadata={"title": title})
             
-            # Split the document using LangChain
+            # Split the document into parent spans using LangChain
             try:
-                chunks = text_splitter.split_documents([doc])
-                print(f"Document split into {len(chunks)} chunks")
+                parents = text_splitter.split_documents([doc])
+                print(f"Document split into {len(parents)} parent chunks")
             except Exception as e:
                 print(f"Error splitting document: {str(e)}")
                 return False
             
-            # Generate embeddings for each chunk and store in database
+            # Store each parent span, and embed its sentence-window children for matching
+            upload_id = uuid.uuid4().hex[:12]
             documents = []
-            for i, chunk in enumerate(chunks):
-                print(f"Processing chunk {i+1}/{len(chunks)}")
-                print(f"Chunk length: {len(chunk.page_content)} characters")
+            child_count = 0
+            for i, parent in enumerate(parents):
+                print(f"Processing parent chunk {i+1}/{len(parents)}")
+                spans = sentence_windows(parent.page_content, CHILD_CHUNK_SIZE)
+                children = [parent.page_content[start:end] for start, end in spans]
+                print(f"Parent length: {len(parent.page_content)} characters, {len(children)} child chunks")
                 
-                # Retry logic for errors
-                retry_count = 0
-                success = False
-                
-                while retry_count < RAGService.MAX_RETRIES and not success:
-                    try:
-                        # Generate embedding using Ollama
-                        chunk_embedding = RAGService.generate_embedding(chunk.page_content)
-                        print(f"Generated embedding with {len(chunk_embedding)} dimensions")
-                        
-                        # Create document
-                        doc = DocumentCreate(
-                            title=title,
-                            content=chunk.page_content,
-                            chunk_id=f"{title}_{i}",
-                            embedding=chunk_embedding
-                        )
-                        documents.append(doc)
-                        success = True
-                        
-                        # Add delay between successful requests
-                        time.sleep(RAGService.REQUEST_DELAY)
-                        
-                    except Exception as e:
-                        retry_count += 1
-                        wait_time = RAGService.RETRY_DELAY * retry_count
-                        print(f"Error processing chunk (attempt {retry_count}/{RAGService.MAX_RETRIES}): {str(e)}")
-                        if retry_count < RAGService.MAX_RETRIES:
-                            print(f"Waiting {wait_time} seconds before retry...")
-                            time.sleep(wait_time)
-                
-                if not success:
-                    print(f"Failed to process chunk {i+1} after {RAGService.MAX_RETRIES} attempts")
+                # Retries and pacing happen inside the rate-limited embedding call
+                try:
+                    child_embeddings = RAGService.generate_embeddings(children)
+                except Exception as e:
+                    print(f"Failed to process parent chunk {i+1} after {RAGService.MAX_RETRIES} attempts: {str(e)}")
                     continue
+                
+                # Parents are stored without an embedding, only children are searched
+                documents.append(DocumentCreate(
+                    title=title,
+                    content=parent.page_content,
+                    chunk_id=parent_chunk_id(title, upload_id, i),
+                    embedding=None
+                ))
+                # Children only hold an embedding; their text is the span of the parent named in the chunk id
+                for j, (span, child_embedding) in enumerate(zip(spans, child_embeddings)):
+                    documents.append(DocumentCreate(
+                        title=title,
+                        content="",
+                        chunk_id=child_chunk_id(title, upload_id, i, j, span),
+                        embedding=child_embedding
+                    ))
+                child_count += len(children)
             
-            print(f"Created {len(documents)} document objects")
+            print(f"Created {len(documents)} document objects ({child_count} child chunks)")
             
-            if not documents:
+            if child_count == 0:
                 print("No documents were created successfully")
                 return False
             
@@ -194,6 +284,47 @@ class RAGService:
             print(traceback.format_exc())
             return False
     
+    @staticmethod
+    def retrieve_batch(query_embeddings: List[List[float]], top_k: int) -> List[List[DocumentModel]]:
+        """
+        Match sentence-window chunks for each query, then replace them with their
+        parent spans. Hits on the same parent are merged, so each query gets up to
+        `top_k` distinct spans ranked by their best matching child.
+        """
+        children_per_query = DocumentDAO.search_documents_batch(
+            query_embeddings, top_k * RAGService.CHILD_CANDIDATES_PER_PARENT
+        )
+        
+        # Fetch the parents for every query in one go
+        parent_ids = list({
+            get_parent_chunk_id(child.chunk_id)
+            for children in children_per_query for child in children
+        } - {None})
+        parents = DocumentDAO.get_documents_by_chunk_ids(parent_ids) if parent_ids else {}
+        
+        results = []
+        for children in children_per_query:
+            documents = []
+            seen = set()
+            for child in children:
+                parent_id = get_parent_chunk_id(child.chunk_id)
+                # Chunks indexed before the two-level split have no parent and are used as is;
+                # children without their parent have no text of their own and are skipped
+                key = parent_id if parent_id in parents else child.chunk_id
+                if key != parent_id and not child.content:
+                    continue
+                if key in seen:
+                    continue
+                seen.add(key)
+                if key == parent_id:
+                    documents.append(parents[parent_id].model_copy(update={"similarity": child.similarity}))
+                else:
+                    documents.append(child)
+                if len(documents) == top_k:
+                    break
+            results.append(documents)
+        return results
+    
     @staticmethod
     def query(query_request: QueryRequest) -> QueryResponse:
         """
@@ -202,23 +333,13 @@ class RAGService:
         try:
             print(f"Processing query: {query_request.query}")
             
-            # Retry logic for query embedding
-            retry_count = 0
-            query_embedding = None
-            
-            while retry_count < RAGService.MAX_RETRIES and query_embedding is None:
-                try:
-                    # Generate embedding for the query using Ollama
-                    query_embedding = RAGService.generate_embedding(query_request.query)
-                    print(f"Generated query embedding with {len(query_embedding)} dimensions")
-                    
-                except Exception as e:
-                    retry_count += 1
-                    wait_time = RAGService.RETRY_DELAY * retry_count
-                    print(f"Error generating query embedding (attempt {retry_count}/{RAGService.MAX_RETRIES}): {str(e)}")
-                    if retry_count < RAGService.MAX_RETRIES:
-                        print(f"Waiting {wait_time} seconds before retry...")
-                        time.sleep(wait_time)
+            # Generate embedding for the query using Ollama (retried inside the rate-limited call)
+            try:
+                query_embedding = RAGService.generate_embedding(query_request.query)
+                print(f"Generated query embedding with {len(query_embedding)} dimensions")
+            except Exception as e:
+                print(f"Error generating query embedding after {RAGService.MAX_RETRIES} attempts: {str(e)}")
+                query_embedding = None
             
             if query_embedding is None:
                 return QueryResponse(
@@ -228,28 +349,12 @@ class RAGService:
                 )
             
             # Retrieve relevant documents
-            documents = DocumentDAO.search_documents(query_embedding, query_request.top_k)
+            documents = RAGService.retrieve_batch([query_embedding], query_request.top_k)[0]
             print(f"Retrieved {len(documents)} relevant documents")
             
-            # Prepare context from retrieved documents
-            context = "\n\n".join([f"Document: {doc.title}\nContent: {doc.content}" for doc in documents])
-            print(f"Context length: {len(context)} characters")
-            
             # Generate response using Groq or Ollama
-            prompt = f"""
-            You are a helpful assistant that provides accurate information about India based on the given context.
-            If the information is not in the context, politely say that you don't have that information.
-            Do not make up answers. Stick to the provided context.
-            
-            Context:
-            {context}
-            
-            Question: {query_request.query}
-            
-            Answer:
-            """
-            
-            answer = RAGService.generate_response(prompt)
+            messages = build_messages(query_request.query, documents)
+            answer = RAGService.generate_response(messages)
             print(f"Generated answer: {answer}")
             
             # Extract sources
@@ -269,6 +374,155 @@ class RAGService:
                 sources=[]
             )
     
+    @staticmethod
+    def collapse_queries(queries: List[str]) -> Tuple[List[str], List[int]]:
+        """
+        Collapse queries that are identical after normalization.
+        Returns the unique queries and, for every input query, the index of its unique query.
+        """
+        unique_queries = []
+        positions = {}
+        assignments = []
+        for query in queries:
+            key = normalize_query(query)
+            if key not in positions:
+                positions[key] = len(unique_queries)
+                unique_queries.append(query)
+            assignments.append(positions[key])
+        return unique_queries, assignments
+    
+    @staticmethod
+    def collapse_similar(embeddings: np.ndarray, threshold: float) -> List[int]:
+        """
+        Map every embedding to the first earlier embedding whose cosine similarity
+        is at least `threshold` (or to itself if there is none).
+        """
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        normalized = embeddings / np.where(norms == 0, 1, norms)
+        similarities = normalized @ normalized.T
+        
+        representatives = list(range(len(embeddings)))
+        for i in range(1, len(embeddings)):
+            matches = np.nonzero(similarities[i, :i] >= threshold)[0]
+            if len(matches) > 0:
+                representatives[i] = representatives[matches[0]]
+        return representatives
+    
+    @staticmethod
+    def batch_failure(queries: List[str], message: str) -> List[BatchQueryResult]:
+        """
+        One error result per query, for failures that affect the whole batch.
+        """
+        return [
+            BatchQueryResult(index=index, query=query, response=message, sources=[])
+            for index, query in enumerate(queries)
+        ]
+    
+    @staticmethod
+    async def query_batch(batch_request: BatchQueryRequest) -> AsyncIterator[BatchQueryResult]:
+        """
+        Process several queries at once: embed them in one call, retrieve documents for all
+        of them together, collapse duplicates and generate answers concurrently.
+        Results are yielded as soon as each answer is ready.
+        """
+        queries = batch_request.queries
+        print(f"Processing batch of {len(queries)} queries")
+        
+        unique_queries, text_assignments = RAGService.collapse_queries(queries)
+        print(f"Collapsed to {len(unique_queries)} unique queries")
+        
+        try:
+            embeddings = np.array(
+                await asyncio.to_thread(RAGService.generate_embeddings, unique_queries),
+                dtype=np.float32
+            )
+        except Exception as e:
+            print(f"Error generating batch embeddings: {str(e)}")
+            for result in RAGService.batch_failure(queries, "Sorry, I'm experiencing issues processing your query right now. Please try again later."):
+                yield result
+            return
+        
+        # Collapse near-identical queries onto a single representative
+        similar_assignments = RAGService.collapse_similar(embeddings, RAGService.BATCH_DEDUP_THRESHOLD)
+        assignments = [similar_assignments[unique] for unique in text_assignments]
+        representatives = sorted(set(assignments))
+        print(f"Generating {len(representatives)} answers for {len(queries)} queries")
+        
+        # Retrieve relevant documents for all representatives together
+        try:
+            documents_per_query = await asyncio.to_thread(
+                RAGService.retrieve_batch,
+                [embeddings[rep].tolist() for rep in representatives],
+                batch_request.top_k
+            )
+        except Exception as e:
+            print(f"Error retrieving batch documents: {str(e)}")
+            print(traceback.format_exc())
+            for result in RAGService.batch_failure(queries, f"Sorry, I encountered an error while processing your query: {str(e)}"):
+                yield result
+            return
+        
+        semaphore = asyncio.Semaphore(batch_request.max_concurrency)
+        
+        async def answer(rep: int, documents: List[DocumentModel]):
+            messages = build_messages(unique_queries[rep], documents)
+            
+            # Bounded per batch and by the generation slots shared with every other query
+            slots = generation_slots()
+            await semaphore.acquire()
+            try:
+                await slots.acquire()
+            except BaseException:
+                semaphore.release()
+                raise
+            
+            def release(generation: asyncio.Future):
+                slots.release()
+                semaphore.release()
+                if not generation.cancelled():
+                    generation.exception()  # mark as retrieved when nobody awaits it any more
+            
+            # A running thread cannot be stopped: if the client disconnects and this task is
+            # cancelled, the slots stay taken until the generation has actually finished
+            generation = asyncio.ensure_future(asyncio.to_thread(RAGService.generate_response, messages))
+            generation.add_done_callback(release)
+            try:
+                response = await asyncio.shield(generation)
+                sources = list(set([doc.title for doc in documents]))
+            except Exception as e:
+                print(f"Error answering batch query: {str(e)}")
+                print(traceback.format_exc())
+                response = f"Sorry, I encountered an error while processing your query: {str(e)}"
+                sources = []
+            return rep, response, sources
+        
+        tasks = [
+            asyncio.create_task(answer(rep, documents))
+            for rep, documents in zip(representatives, documents_per_query)
+        ]
+        
+        # The first query assigned to each representative is the one actually answered
+        first_index = {}
+        for index, rep in enumerate(assignments):
+            first_index.setdefault(rep, index)
+        
+        try:
+            for finished in asyncio.as_completed(tasks):
+                rep, response, sources = await finished
+                for index, assigned in enumerate(assignments):
+                    if assigned != rep:
+                        continue
+                    yield BatchQueryResult(
+                        index=index,
+                        query=queries[index],
+                        response=response,
+                        sources=sources,
+                        duplicate_of=None if first_index[rep] == index else first_index[rep]
+                    )
+        finally:
+            for task in tasks:
+                task.cancel()
+    
     @staticmethod
     def clear_database() -> bool:
         """
@@ -0,0 +1,66 @@
+# src/utils/embedding_cache.py
+import os
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from typing import Dict, List, Optional
+
+class EmbeddingCache:
+    """
+    On-disk embedding cache shared by all worker processes. SQLite in WAL mode
+    lets every worker read concurrently (through mmap) while writes are serialized
+    by SQLite's own locking, so a text is embedded once for the whole server.
+    """
+    MMAP_SIZE = 256 * 1024 * 1024  # bytes of the database file read through mmap
+    BUSY_TIMEOUT = 5.0  # seconds to wait for another process's write lock
+
+    def __init__(self, path: str, model: str):
+        self.path = path
+        self.model = model
+        self.local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread and per process; never reuse one across a fork
+        connection = getattr(self.local, "connection", None)
+        if connection is None or self.local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(f"PRAGMA mmap_size={self.MMAP_SIZE}")
+            connection.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, embedding BLOB NOT NULL)")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str]) -> Dict[str, List[float]]:
+        """Cached embeddings for the given texts, keyed by text."""
+        keys = {self._key(text): text for text in texts}
+        found = {}
+        key_list = list(keys)
+        # Stay well below SQLite's limit on bound parameters
+        for start in range(0, len(key_list), 500):
+            page = key_list[start:start + 500]
+            rows = self._connection().execute(
+                f"SELECT key, embedding FROM embeddings WHERE key IN ({','.join('?' * len(page))})", page
+            ).fetchall()
+            for key, blob in rows:
+                found[keys[key]] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def get(self, text: str) -> Optional[List[float]]:
+        return self.get_many([text]).get(text)
+
+    def put_many(self, texts: List[str], embeddings: List[List[float]]) -> None:
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, embedding) VALUES (?, ?)",
+                [(self._key(text), np.asarray(embedding, dtype=np.float32).tobytes()) for text, embedding in zip(texts, embeddings)]
+            )
+
+    def put(self, text: str, embedding: List[float]) -> None:
+        self.put_many([text], [embedding])
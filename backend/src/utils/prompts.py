@@ -0,0 +1,60 @@
+# src/utils/prompts.py
+import re
+import tiktoken
+from typing import List, Dict
+
+# Fixed prefix: identical on every call so Ollama's KV cache and provider-side
+# prompt caching can reuse it. Per-request text (context, then question) goes after it.
+SYSTEM_PROMPT = (
+    "You are a helpful assistant that provides accurate information about India based on the given context. "
+    "If the information is not in the context, politely say that you don't have that information. "
+    "Do not make up answers. Stick to the provided context."
+)
+
+# Approximate per-message overhead of chat formatting (role markers, separators)
+TOKENS_PER_MESSAGE = 4
+
+_encoding = None
+
+def normalize_whitespace(text: str) -> str:
+    """
+    Collapse runs of whitespace into single spaces.
+    """
+    return re.sub(r'\s+', ' ', text).strip()
+
+def normalize_lines(text: str) -> str:
+    """
+    Collapse spaces and tabs and drop blank lines, but keep line breaks so
+    lists and tables in a chunk keep their structure.
+    """
+    lines = (re.sub(r'[ \t\f\v]+', ' ', line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+def format_context(documents) -> str:
+    """
+    Format retrieved documents as compact context blocks.
+    """
+    return "\n\n".join(
+        f"[{normalize_whitespace(doc.title)}]\n{normalize_lines(doc.content)}"
+        for doc in documents
+    )
+
+def build_messages(query: str, documents) -> List[Dict[str, str]]:
+    """
+    Build chat messages ordered for prefix caching: system instructions first,
+    context second, question last.
+    """
+    context = format_context(documents)
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {normalize_whitespace(query)}\nAnswer:"}
+    ]
+
+def count_tokens(messages: List[Dict[str, str]]) -> int:
+    """
+    Estimate the number of input tokens for a list of chat messages.
+    """
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return sum(TOKENS_PER_MESSAGE + len(_encoding.encode(message["content"])) for message in messages)
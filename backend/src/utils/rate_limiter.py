@@ -0,0 +1,153 @@
+# src/utils/rate_limiter.py
+import os
+import time
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+# Default (requests per second, burst) per backend. Groq limits are per model,
+# so every "groq:<model>" limiter gets its own bucket with the "groq" defaults.
+DEFAULT_LIMITS: Dict[str, Tuple[float, float]] = {
+    "ollama-embed": (50.0, 50.0),
+    "ollama-chat": (4.0, 4.0),
+    "groq": (0.5, 5.0),
+    "supabase": (50.0, 50.0),
+}
+
+class TokenBucket:
+    """
+    Thread-safe token bucket whose rate adapts to the backend: it is halved on
+    every rate-limit response (honouring Retry-After) and grows back slowly on success.
+    """
+    DECREASE_FACTOR = 0.5
+    INCREASE_FRACTION = 0.05  # of the initial rate, added per successful call
+    MIN_RATE_FRACTION = 0.05  # of the initial rate
+
+    def __init__(self, name: str, rate: float, capacity: float):
+        self.name = name
+        self.initial_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def _wait_time(self, now: float) -> float:
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def expected_wait(self) -> float:
+        """Seconds until the next call would be allowed."""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            return self._wait_time(now)
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """
+        Take one token, sleeping only for as long as the bucket is empty.
+        Returns False if that would take longer than `timeout`.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._wait_time(now)
+                if wait == 0:
+                    self.tokens -= 1
+                    return True
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def on_success(self) -> None:
+        with self.lock:
+            self.rate = min(self.initial_rate, self.rate + self.initial_rate * self.INCREASE_FRACTION)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None) -> None:
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.initial_rate * self.MIN_RATE_FRACTION, self.rate * self.DECREASE_FACTOR)
+            self.tokens = min(self.tokens, 0.0)
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            print(f"Rate limited by {self.name}: rate lowered to {self.rate:.2f} req/s"
+                  + (f", paused for {retry_after:.1f}s" if retry_after else ""))
+
+class RateLimitTimeout(Exception):
+    """Raised when a limiter would block a call for longer than the caller allows."""
+
+_limiters: Dict[str, TokenBucket] = {}
+_registry_lock = threading.Lock()
+
+def get_limiter(name: str) -> TokenBucket:
+    """
+    Return the shared limiter for a backend, creating it on first use.
+    """
+    with _registry_lock:
+        if name not in _limiters:
+            rate, capacity = DEFAULT_LIMITS.get(name) or DEFAULT_LIMITS[name.split(":")[0]]
+            # Limiters are per process, so each worker gets an equal share of the sustained rate.
+            # The burst is not split: a worker alone would otherwise get buckets too small to
+            # absorb a few concurrent requests, and bursts that collide are caught by the 429 backoff.
+            # Read at creation time: the server sets WORKERS after the app may have been imported.
+            workers = max(1, int(os.environ.get("WORKERS", 1)))
+            _limiters[name] = TokenBucket(name, rate / workers, capacity)
+        return _limiters[name]
+
+def _status_code(error: Exception) -> Optional[int]:
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code
+
+def is_rate_limited(error: Exception) -> bool:
+    """
+    Whether an exception from a backend client is a rate-limit (429) response.
+    """
+    return _status_code(error) == 429 or "rate limit" in str(error).lower()
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """
+    Read the Retry-After header (in seconds) from a backend client exception, if present.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def call_with_limit(name: str, func: Callable, *args, max_retries: int = 3, retry_backoff: float = 0.5, timeout: Optional[float] = None, **kwargs):
+    """
+    Call `func` through the named backend's limiter. Rate-limit errors slow the
+    limiter down and are retried once it allows; other errors are retried with a
+    short exponential backoff. The last error is re-raised. Raises
+    RateLimitTimeout if the limiter would make a call wait longer than `timeout`.
+    """
+    limiter = get_limiter(name)
+    for attempt in range(1, max_retries + 1):
+        if not limiter.acquire(timeout):
+            raise RateLimitTimeout(f"{name} is rate limited for more than {timeout:.1f}s")
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if is_rate_limited(e):
+                limiter.on_rate_limited(get_retry_after(e))
+            elif attempt < max_retries:
+                time.sleep(retry_backoff * 2 ** (attempt - 1))
+            if attempt == max_retries:
+                raise
+            print(f"Error calling {name} (attempt {attempt}/{max_retries}): {str(e)}")
+            continue
+        limiter.on_success()
+        return result
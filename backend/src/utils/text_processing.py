@@ -1,7 +1,8 @@
 # src/utils/text_processing.py
 import re
 import tiktoken
-from typing import List
+from typing import List, Optional, Tuple
+from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
     """
@@ -38,4 +39,92 @@ def clean_text(text: str) -> str:
     # Remove special characters that might cause issues
     text = re.sub(r'[^\w\s\.\,\!\?\;\:\-\(\)\[\]\{\}\"\'\/\@\#\$\%\^\&\*\+\=\~\`]', '', text)
     
-    return text.strip()
\ No newline at end of file
+    return text.strip()
+
+def normalize_query(text: str) -> str:
+    """
+    Normalize a query for duplicate detection: lowercase, collapse whitespace
+    and drop trailing punctuation.
+    """
+    text = re.sub(r'\s+', ' ', text).strip().lower()
+    return text.rstrip('?!.;: ')
+
+def sentence_spans(text: str) -> List[Tuple[int, int]]:
+    """
+    (start, end) offsets of the sentences in `text`, split on terminal punctuation
+    followed by whitespace. Surrounding whitespace is not part of a span.
+    """
+    spans = []
+    start = 0
+    for boundary in [*re.finditer(r'(?<=[.!?])\s+', text), None]:
+        end = boundary.start() if boundary else len(text)
+        piece = text[start:end]
+        if piece.strip():
+            spans.append((start + len(piece) - len(piece.lstrip()), start + len(piece.rstrip())))
+        if boundary:
+            start = boundary.end()
+    return spans
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Split text into sentences on terminal punctuation followed by whitespace.
+    """
+    return [text[start:end] for start, end in sentence_spans(text)]
+
+def sentence_windows(text: str, max_chars: int = 250) -> List[Tuple[int, int]]:
+    """
+    Pack consecutive sentences into windows of at most `max_chars` characters and
+    return their (start, end) offsets in `text`. Sentences longer than `max_chars`
+    (or text without sentence punctuation) are split further on paragraph, line
+    and word boundaries.
+    """
+    splitter = RecursiveCharacterTextSplitter(chunk_size=max_chars, chunk_overlap=0)
+    pieces = []
+    for start, end in sentence_spans(text):
+        if end - start <= max_chars:
+            pieces.append((start, end))
+            continue
+        # Locate the splitter's pieces in the sentence to keep their offsets
+        cursor = start
+        for piece in splitter.split_text(text[start:end]):
+            piece_start = text.find(piece, cursor, end)
+            if piece_start < 0:
+                continue
+            pieces.append((piece_start, piece_start + len(piece)))
+            cursor = piece_start + len(piece)
+    
+    windows = []
+    for start, end in pieces:
+        if windows and end - windows[-1][0] <= max_chars:
+            windows[-1] = (windows[-1][0], end)
+        else:
+            windows.append((start, end))
+    return windows
+
+def parent_chunk_id(title: str, upload_id: str, parent_index: int) -> str:
+    """
+    Chunk id of a parent span: "<title>_<upload>_p<parent>". The upload id keeps
+    parents unique when several uploads share a title.
+    """
+    return f"{title}_{upload_id}_p{parent_index}"
+
+def child_chunk_id(title: str, upload_id: str, parent_index: int, child_index: int, span: Tuple[int, int]) -> str:
+    """
+    Chunk id of a sentence-window chunk: "<title>_<upload>_p<parent>_c<child>_<start>-<end>",
+    where start and end locate the window's text in the parent span.
+    """
+    return f"{parent_chunk_id(title, upload_id, parent_index)}_c{child_index}_{span[0]}-{span[1]}"
+
+def get_parent_chunk_id(chunk_id: str) -> Optional[str]:
+    """
+    Parent chunk id of a sentence-window chunk, or None for chunks without a parent.
+    """
+    match = re.match(r'^(.*_p\d+)_c\d+(?:_\d+-\d+)?$', chunk_id)
+    return match.group(1) if match else None
+
+def get_child_span(chunk_id: str) -> Optional[Tuple[int, int]]:
+    """
+    (start, end) of a sentence-window chunk's text in its parent, or None if the id has no span.
+    """
+    match = re.match(r'^.*_p\d+_c\d+_(\d+)-(\d+)$', chunk_id)
+    return (int(match.group(1)), int(match.group(2))) if match else None
\ No newline at end of file